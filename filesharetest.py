@@ -1,28 +1,51 @@
 # streamlit_sender.py
 import streamlit as st
-import json
+import orjson
 import firebase_admin
 from firebase_admin import credentials, firestore
-import base64
-import zlib
+from google.auth.transport.requests import AuthorizedSession
+import pybase64
+import zstandard as zstd
 import uuid
 import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # ---------- CONFIG ----------
-CHUNK_TEXT_SIZE = 900_000
+# ~100KB of headroom under Firestore's 1MiB document limit for the
+# file_name/chunk_index fields and internal overhead
+CHUNK_SIZE = 900_000
 COLLECTION = "files"
+CODEC = "zstd"
+# level 3 is the speed/ratio sweet spot; threads=-1 lets zstd parallelize
+# internally for larger inputs
+ZSTD_LEVEL = 3
+UPLOAD_WORKERS = 32
+STREAM_WINDOW = 1 << 20  # feed compressor/hasher 1MB at a time
+# batchWrite accepts up to 500 writes / 10MiB per request; cap raw chunk
+# bytes lower since the wire encoding is base64 (+33%)
+BATCH_WRITE_MAX_DOCS = 500
+BATCH_WRITE_MAX_BYTES = 6_000_000
+BATCH_WRITE_RETRIES = 4  # retries per batch on transient HTTP errors
 
 # ---------- FIREBASE INIT ----------
+@st.cache_resource
 def init_db():
+    # cache_resource runs this once per worker process; reruns triggered by
+    # widget interaction reuse the client (and its gRPC channel) instead of
+    # re-parsing the service account (the private-key PEM parse is the
+    # expensive part). Note: gRPC keepalive is only configurable via channel
+    # options, which firebase_admin does not expose; the cached client is
+    # what keeps chunk writes on a warm channel.
     sa_json = st.secrets.get("firebase_service_account") if st.secrets else None
     if sa_json:
-        sa = json.loads(sa_json)
+        sa = orjson.loads(sa_json)
     else:
         fallback_path = st.secrets.get("service_account_file") if st.secrets else None
         if not fallback_path:
             raise RuntimeError("Provide firebase_service_account in Streamlit secrets or service_account_file path.")
-        with open(fallback_path, "r", encoding="utf-8") as f:
-            sa = json.load(f)
+        with open(fallback_path, "rb") as f:
+            sa = orjson.loads(f.read())
 
     if "private_key" in sa and isinstance(sa["private_key"], str):
         sa["private_key"] = sa["private_key"].replace("\\n", "\n")
@@ -35,6 +58,15 @@ def init_db():
 
     return firestore.client(app=app)
 
+@st.cache_resource
+def init_rest():
+    # batchWrite is only exposed over REST, so keep one authorized HTTP
+    # session per worker alongside the gRPC client
+    app = firebase_admin.get_app()
+    session = AuthorizedSession(app.credential.get_credential())
+    doc_root = f"projects/{app.project_id}/databases/(default)/documents"
+    return session, doc_root
+
 try:
     db = init_db()
     st.success("✅ Firebase initialized")
@@ -42,49 +74,101 @@ except Exception as e:
     st.error("❌ Firebase init failed: " + str(e))
     st.stop()
 
-# ---------- HELPERS ----------
-def sha256_bytes(b: bytes) -> str:
-    return hashlib.sha256(b).hexdigest()
-
-def compress_and_encode_bytes(b: bytes) -> str:
-    return base64.b64encode(zlib.compress(b)).decode("utf-8")
-
-def chunk_text(text: str, size: int = CHUNK_TEXT_SIZE):
-    return [text[i:i+size] for i in range(0, len(text), size)]
-
 # ---------- SENDER ----------
-def send_file_to_firestore(file_bytes: bytes, file_name: str) -> tuple[str, int]:
-    file_sha = sha256_bytes(file_bytes)
-    full_b64 = compress_and_encode_bytes(file_bytes)
-    chunks = chunk_text(full_b64, CHUNK_TEXT_SIZE)
-    total_chunks = len(chunks)
+def send_file_to_firestore(file_bytes: bytes | memoryview, file_name: str) -> tuple[str, int]:
     file_id = str(uuid.uuid4())
-
-    # Batch write with periodic commits to avoid huge batches
-    batch = db.batch()
-    written = 0
-    for idx, piece in enumerate(chunks):
-        doc_ref = db.collection(COLLECTION).document(f"{file_id}_{idx}")
-        # ensure file_name is present in each chunk doc for robustness
-        batch.set(doc_ref, {
-            "file_name": file_name,
-            "chunk_index": idx,
-            "total_chunks": total_chunks,
-            "data": piece
-        })
-        written += 1
-        if written % 300 == 0:
-            batch.commit()
-            batch = db.batch()
-    batch.commit()
+    mv = memoryview(file_bytes)
+    size_bytes = len(mv)
+    coll = db.collection(COLLECTION)
+
+    session, doc_root = init_rest()
+    batch_url = f"https://firestore.googleapis.com/v1/{doc_root}:batchWrite"
+    chunk_prefix = f"{doc_root}/{COLLECTION}/{file_id}_"
+
+    def chunk_write(idx: int, piece: bytes) -> dict:
+        # ensure file_name is present in each chunk doc for robustness;
+        # total_chunks lives in the manifest (unknown while streaming).
+        # bytesValue is base64 on the wire - the REST price of collapsing
+        # hundreds of document writes into one HTTP call
+        return {"update": {
+            "name": chunk_prefix + str(idx),
+            "fields": {
+                "file_name": {"stringValue": file_name},
+                "chunk_index": {"integerValue": str(idx)},
+                "data": {"bytesValue": pybase64.b64encode(piece).decode("ascii")}
+            }
+        }}
+
+    def post_batch(writes: list) -> int:
+        # the gRPC SDK retried transient errors for us; over raw REST we do
+        # a bounded exponential backoff before failing the upload
+        for attempt in range(BATCH_WRITE_RETRIES + 1):
+            resp = session.post(batch_url, json={"writes": writes})
+            if resp.status_code in (429, 500, 502, 503, 504) and attempt < BATCH_WRITE_RETRIES:
+                time.sleep(0.5 * (2 ** attempt))
+                continue
+            break
+        resp.raise_for_status()
+        for status in resp.json().get("status", []):
+            if status.get("code"):
+                raise RuntimeError(f"batchWrite rejected a chunk: {status}")
+        return len(writes)
+
+    # Stream the file through hasher and compressor in 1MB windows; the
+    # chunker emits fixed-size compressed pieces that are grouped into
+    # batchWrite requests and posted concurrently while later windows are
+    # still being compressed
+    hasher = hashlib.sha256()
+    # ZstdCompressor is not thread-safe, so each upload (Streamlit sessions
+    # run in separate threads of one process) gets its own context; creating
+    # one is cheap next to compressing a file with it
+    cctx = zstd.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+    chunker = cctx.chunker(size=size_bytes, chunk_size=CHUNK_SIZE)
+    progress = st.progress(0.0)
+    futures = []
+    total_chunks = 0
+    pending = []
+    pending_bytes = 0
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as ex:
+        def flush_pending():
+            nonlocal pending, pending_bytes
+            if pending:
+                futures.append(ex.submit(post_batch, pending))
+                pending = []
+                pending_bytes = 0
+
+        def queue_piece(piece: bytes):
+            nonlocal pending_bytes, total_chunks
+            pending.append(chunk_write(total_chunks, piece))
+            pending_bytes += len(piece)
+            total_chunks += 1
+            if len(pending) >= BATCH_WRITE_MAX_DOCS or pending_bytes >= BATCH_WRITE_MAX_BYTES:
+                flush_pending()
+
+        for off in range(0, size_bytes, STREAM_WINDOW):
+            window = mv[off:off + STREAM_WINDOW]
+            hasher.update(window)
+            for piece in chunker.compress(window):
+                queue_piece(bytes(piece))
+        for piece in chunker.finish():
+            queue_piece(bytes(piece))
+        flush_pending()
+
+        done = 0
+        for fut in as_completed(futures):
+            done += fut.result()
+            progress.progress(done / total_chunks)
+    progress.empty()
+    file_sha = hasher.hexdigest()
 
     # Create manifest (guarantees receiver can get filename + sha)
-    db.collection(COLLECTION).document(f"{file_id}_meta").set({
+    coll.document(f"{file_id}_meta").set({
         "file_id": file_id,
         "file_name": file_name,
         "total_chunks": total_chunks,
+        "codec": CODEC,
         "sha256": file_sha,
-        "size_bytes": len(file_bytes),
+        "size_bytes": size_bytes,
         "uploaded_at": firestore.SERVER_TIMESTAMP
     })
 
@@ -97,7 +181,7 @@ def send_file_to_firestore(file_bytes: bytes, file_name: str) -> tuple[str, int]
     return file_id, total_chunks
 
 # ---------- STREAMLIT UI ----------
-st.title("📤 File sender → Firestore (compress → base64 → chunk)")
+st.title("📤 File sender → Firestore (compress → chunk)")
 
 uploaded = st.file_uploader("Choose a file to upload (PDF etc.)", accept_multiple_files=False)
 if uploaded:
@@ -105,8 +189,9 @@ if uploaded:
     if st.button("Send to Firestore"):
         with st.spinner("Compressing, encoding and uploading..."):
             try:
-                b = uploaded.read()
-                fid, total = send_file_to_firestore(b, uploaded.name)
+                # getbuffer() is a zero-copy view into Streamlit's BytesIO;
+                # read() would duplicate the whole upload in memory
+                fid, total = send_file_to_firestore(uploaded.getbuffer(), uploaded.name)
                 st.success(f"Uploaded ✅ File ID: `{fid}` — chunks: {total}")
                 st.code(fid, language="text")
                 st.info("Save the File ID for the receiver to download.")
@@ -117,6 +202,6 @@ st.markdown(
     """
 **Notes**
 - Sender stores `file_name` (including extension) in every chunk and in a manifest `{file_id}_meta`.
-- Receiver will reassemble Base64, decode, decompress, and verify SHA256.
+- Receiver will concatenate the blob chunks, decompress, and verify SHA256.
 """
 )